@@ -0,0 +1 @@
+from .main import enqueue_changed_cards, process_pending_estimates
\ No newline at end of file
@@ -0,0 +1,262 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from google.api_core.exceptions import NotFound
+from google.cloud import firestore
+from card_time_estimate import estimate_card
+
+# Seconds a card must stay unedited before it is estimated (debounces rapid edits)
+DEBOUNCE_SECONDS = 60
+# Default number of background estimates a board may run, overridable per board via `backgroundEstimateBudget`
+DEFAULT_BUDGET = 100
+# Max pending estimates processed per scheduled run, kept well inside the scheduler's timeout
+MAX_ESTIMATES_PER_RUN = 10
+# Seconds after which a "running" estimate is presumed lost (timeout, crashed instance) and reclaimed
+LEASE_SECONDS = 600
+# Claims per queued estimate before it is left as "failed"
+MAX_ATTEMPTS = 3
+# Statuses that hold a card until the board's settings change
+HELD_STATUSES = ["disabled", "budgetExceeded", "failed"]
+# Firestore's limit on writes per batch
+BATCH_LIMIT = 500
+
+def get_estimation_columns(board):
+    """ Columns enabled for time estimation, in the same shape the client sends to card_time_estimate. """
+    return [
+        {"id": c.get("id"), "title": c.get("title"), "description": c.get("description")}
+        for c in board.get("columns", [])
+        if c.get("timeEstimationEnabled")
+    ]
+
+def card_fingerprint(card, columns):
+    """ Hash of the inputs that affect an estimate: title, description, type and estimation columns. """
+    payload = {
+        "title": card.get("title", ""),
+        "description": card.get("description", ""),
+        "type": card.get("type"),
+        "columns": columns,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def get_card_fingerprints(board):
+    """ Map of cardId -> fingerprint for every card on a board snapshot. """
+    if not board:
+        return {}
+    columns = get_estimation_columns(board)
+    if not columns:
+        return {}
+    return {card_id: card_fingerprint(card, columns) for card_id, card in board.get("cards", {}).items()}
+
+def enqueue_changed_cards(board_ref, before, after):
+    """
+    Compare board snapshots and queue new or estimate-relevantly edited cards under:
+      /users/{userId}/boards/{boardId}/pendingEstimates/{cardId}
+
+    Re-queueing a card overwrites its pending doc and pushes back `updatedAt`,
+    so a burst of edits results in a single estimate once the card settles.
+    Writing `timeEstimate` back to the board does not change any fingerprint, so it never re-queues.
+
+    When background estimates are switched on or the budget is raised, cards held as
+    "disabled"/"budgetExceeded"/"failed" are re-queued; switching on also queues cards with no estimate yet.
+
+    Note: estimation columns are part of every fingerprint, so editing or toggling one re-queues
+    every card on the board. Each of those estimates is charged, so such a change can use up the
+    board's whole `backgroundEstimateBudget`; remaining cards are held as "budgetExceeded".
+    """
+    if not after:
+        return
+    before = before or {}
+    pending_coll = board_ref.collection("pendingEstimates")
+    if get_estimation_columns(before) and not get_estimation_columns(after):
+        # Nothing left to estimate against; drop the whole queue
+        print(f"No estimation columns left on board {board_ref.id}, clearing pending estimates")
+        commit_in_batches([("delete", doc.reference, None) for doc in pending_coll.stream()])
+        return
+    if not after.get("backgroundEstimatesEnabled"):
+        return
+    newly_enabled = not before.get("backgroundEstimatesEnabled")
+    budget_raised = (
+        after.get("backgroundEstimateBudget", DEFAULT_BUDGET)
+        > before.get("backgroundEstimateBudget", DEFAULT_BUDGET)
+    )
+    before_fingerprints = get_card_fingerprints(before)
+    after_fingerprints = get_card_fingerprints(after)
+    to_queue = {
+        card_id: fingerprint for card_id, fingerprint in after_fingerprints.items()
+        if before_fingerprints.get(card_id) != fingerprint
+    }
+    removed = set(before_fingerprints) - set(after.get("cards", {}))
+
+    if newly_enabled:
+        for card_id, fingerprint in after_fingerprints.items():
+            if not after["cards"][card_id].get("timeEstimate"):
+                to_queue[card_id] = fingerprint
+    if newly_enabled or budget_raised:
+        for held_doc in pending_coll.where("status", "in", HELD_STATUSES).stream():
+            if held_doc.id in after_fingerprints:
+                to_queue[held_doc.id] = after_fingerprints[held_doc.id]
+            else:
+                removed.add(held_doc.id)
+
+    if not to_queue and not removed:
+        return
+    print(f"Queueing background estimates for cards: {list(to_queue)}")
+
+    writes = [("delete", pending_coll.document(card_id), None) for card_id in removed]
+    writes += [
+        ("set", pending_coll.document(card_id), {
+            "cardId": card_id,
+            "fingerprint": fingerprint,
+            "status": "pending",
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        })
+        for card_id, fingerprint in to_queue.items()
+    ]
+    commit_in_batches(writes)
+
+def commit_in_batches(writes):
+    """ Commit (op, doc_ref, data) writes in batches of at most BATCH_LIMIT. """
+    db = firestore.Client()
+    for start in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for op, doc_ref, data in writes[start:start + BATCH_LIMIT]:
+            if op == "delete":
+                batch.delete(doc_ref)
+            else:
+                batch.set(doc_ref, data)
+        batch.commit()
+
+def reserve_estimate(db, pending_ref, board_ref, cutoff, lease_cutoff):
+    """
+    Transactionally claim a pending (or lease-expired running) estimate and charge it against
+    the board's budget. Missing cards, boards without estimation columns and cards edited since
+    they were queued are resolved here, before anything is charged.
+    Returns {"fingerprint", "card", "columns", "attempts"}, or None if the estimate should not run.
+    """
+    usage_ref = board_ref.collection("historicalStats").document("estimateUsage")
+    card_id = pending_ref.id
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def reserve_tx(tx):
+        pending = pending_ref.get(transaction=tx).to_dict() or {}
+        status = pending.get("status")
+        # Edited again since the query ran (a later run will pick it up), or claimed by another run
+        is_settled = status == "pending" and pending.get("updatedAt") <= cutoff
+        is_lost = status == "running" and pending.get("claimedAt") <= lease_cutoff
+        if not is_settled and not is_lost:
+            return None
+        attempts = pending.get("attempts", 0)
+        if is_lost and attempts >= MAX_ATTEMPTS:
+            tx.update(pending_ref, {"status": "failed"})
+            return None
+        board = board_ref.get(transaction=tx).to_dict() or {}
+        card = board.get("cards", {}).get(card_id)
+        columns = get_estimation_columns(board)
+        if not card or not columns:
+            tx.delete(pending_ref)
+            return None
+        if not board.get("backgroundEstimatesEnabled"):
+            tx.update(pending_ref, {"status": "disabled"})
+            return None
+        fingerprint = card_fingerprint(card, columns)
+        if fingerprint != pending.get("fingerprint"):
+            # Edited since it was queued; hand it back to the queue with the current content
+            tx.update(pending_ref, {
+                "fingerprint": fingerprint,
+                "status": "pending",
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            })
+            return None
+        usage = usage_ref.get(transaction=tx).to_dict() or {}
+        budget = board.get("backgroundEstimateBudget", DEFAULT_BUDGET)
+        if usage.get("backgroundEstimatesUsed", 0) >= budget:
+            tx.update(pending_ref, {"status": "budgetExceeded"})
+            return None
+        tx.set(usage_ref, {"backgroundEstimatesUsed": firestore.Increment(1)}, merge=True)
+        tx.update(pending_ref, {
+            "status": "running",
+            "claimedAt": firestore.SERVER_TIMESTAMP,
+            "attempts": attempts + 1,
+        })
+        return {"fingerprint": fingerprint, "card": card, "columns": columns, "attempts": attempts + 1}
+
+    return reserve_tx(transaction)
+
+def save_estimate(db, pending_ref, board_ref, card_id, fingerprint, result):
+    """
+    Transactionally write the estimate to the card's `timeEstimate`, only if the card
+    still exists and has not been edited while the estimate was computed.
+    """
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def save_tx(tx):
+        board = board_ref.get(transaction=tx).to_dict() or {}
+        card = board.get("cards", {}).get(card_id)
+        if not card or card_fingerprint(card, get_estimation_columns(board)) != fingerprint:
+            return False
+        tx.update(board_ref, {
+            firestore.FieldPath("cards", card_id, "timeEstimate").to_api_repr(): result,
+        })
+        tx.update(pending_ref, {"status": "done"})
+        return True
+
+    return save_tx(transaction)
+
+def process_pending_estimates():
+    """
+    Estimate every queued card whose last edit is older than DEBOUNCE_SECONDS (plus any
+    estimate whose run was lost), writing results to the card's `timeEstimate` on its board document.
+    """
+    db = firestore.Client()
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(seconds=DEBOUNCE_SECONDS)
+    lease_cutoff = now - timedelta(seconds=LEASE_SECONDS)
+    pending_estimates = db.collection_group("pendingEstimates")
+    pending_docs = list(
+        pending_estimates
+          .where("status", "==", "running")
+          .where("claimedAt", "<=", lease_cutoff)
+          .limit(MAX_ESTIMATES_PER_RUN)
+          .stream()
+    )
+    if len(pending_docs) < MAX_ESTIMATES_PER_RUN:
+        pending_docs += list(
+            pending_estimates
+              .where("status", "==", "pending")
+              .where("updatedAt", "<=", cutoff)
+              .limit(MAX_ESTIMATES_PER_RUN - len(pending_docs))
+              .stream()
+        )
+    print(f"Pending background estimates: {len(pending_docs)}")
+
+    for pending_doc in pending_docs:
+        pending_ref = pending_doc.reference
+        board_ref = pending_ref.parent.parent
+        user_id = board_ref.parent.parent.id
+        card_id = pending_doc.id
+        claim = None
+        try:
+            claim = reserve_estimate(db, pending_ref, board_ref, cutoff, lease_cutoff)
+            if not claim:
+                continue
+            card = claim["card"]
+            result = estimate_card(user_id, board_ref.id, card, card.get("codebaseContext", ""), claim["columns"])
+            saved = save_estimate(db, pending_ref, board_ref, card_id, claim["fingerprint"], result)
+            print(f"Background estimate for card {card_id} on board {board_ref.id} saved: {saved}")
+        except Exception as e:
+            print(f"Error computing background estimate for card {card_id}: {e}")
+            if not claim:
+                # Failed before claiming; the doc is untouched and a later run retries it
+                continue
+            # Retry after the debounce window until MAX_ATTEMPTS, then hold as "failed"
+            retry = claim["attempts"] < MAX_ATTEMPTS
+            try:
+                pending_ref.update({
+                    "status": "pending" if retry else "failed",
+                    "updatedAt": firestore.SERVER_TIMESTAMP,
+                })
+            except NotFound:
+                # Card was removed (and its pending doc deleted) while estimating
+                pass
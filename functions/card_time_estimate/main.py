@@ -11,31 +11,95 @@
 # - card estimate per column (need to decide on columns or how we can track that back to the board)
 import openai
 import dotenv
+from google.cloud import firestore
 from .system_prompts import PROMPT
 import json
-from historical_cards import get_historical_card_summary, fetch_similar_historical_cards, get_random_historical_card_by_type
+from historical_cards import get_historical_card_summary, fetch_similar_historical_cards, get_random_historical_card_by_type, is_shared_retrieval_enabled, get_shared_historical_card_summary
+
+# Below this many local cards of the card's type, use the shared (cross-board) summary instead
+MIN_LOCAL_SUMMARY_CARDS = 5
 
 dotenv.load_dotenv()
 
+def serialize_for_prompt(value):
+    """ Deterministic JSON serialization so identical content always yields identical prompt bytes. """
+    return json.dumps(value, sort_keys=True, default=str)
+
+def build_llm_input(card, codebase_context, historical_card_data, historical_card_summary, columns):
+    """
+    Assemble the LLM input in cache-friendly layers, most stable first:
+      1. board layer: columns and pruned summary (shared by every card of a type on the board)
+      2. card layer: similar cards, codebase context and the card itself
+    The static instructions (PROMPT) are sent separately ahead of both layers.
+    """
+    board_layer = (
+        f"board_columns: {serialize_for_prompt(columns)}\n\n"
+        f"historical_card_summary: {serialize_for_prompt(historical_card_summary)}"
+    )
+    card_layer = (
+        f"historical_card_data: {serialize_for_prompt(historical_card_data)}\n\n"
+        f"codebase_context: {codebase_context or ''}\n\n"
+        f"Card Info: {serialize_for_prompt(card)}"
+    )
+    return f"{board_layer}\n\n{card_layer}"
+
+def get_usage_stats(response):
+    """ Extract token usage (including provider cached tokens) from a Responses API result. """
+    usage = getattr(response, "usage", None)
+    if not usage:
+        return {}
+    details = getattr(usage, "input_tokens_details", None)
+    return {
+        "inputTokens": getattr(usage, "input_tokens", 0) or 0,
+        "cachedInputTokens": getattr(details, "cached_tokens", 0) or 0,
+        "outputTokens": getattr(usage, "output_tokens", 0) or 0,
+    }
+
+def record_llm_usage(user_id, board_id, usage):
+    """
+    Accumulate token usage for estimates under:
+      /users/{userId}/boards/{boardId}/historicalStats/estimateUsage
+    so prompt cache hit rates can be measured per board.
+    """
+    if not usage or not user_id or not board_id:
+        return
+    db = firestore.Client()
+    usage_ref = (
+        db.collection("users").document(user_id)
+          .collection("boards").document(board_id)
+          .collection("historicalStats")
+          .document("estimateUsage")
+    )
+    usage_ref.set({
+        "totalEstimates": firestore.Increment(1),
+        "totalInputTokens": firestore.Increment(usage.get("inputTokens", 0)),
+        "totalCachedInputTokens": firestore.Increment(usage.get("cachedInputTokens", 0)),
+        "totalOutputTokens": firestore.Increment(usage.get("outputTokens", 0)),
+        "lastUpdated": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
 def call_llm(card, codebase_context, historical_card_data, historical_card_summary, columns):
-    # Format the system prompt with the provided inputs
-    formatted_prompt = PROMPT.format(
-        codebase_context=codebase_context,
-        historical_card_data=historical_card_data,
-        historical_card_summary=historical_card_summary,
-        board_columns=json.dumps(columns)
+    """ Call the LLM and return (parsed estimate, token usage). """
+    llm_input = build_llm_input(
+        card,
+        codebase_context,
+        historical_card_data,
+        historical_card_summary,
+        columns
     )
-    print(f"Formatted prompt: {formatted_prompt}")
-    # Send to LLM
+    print(f"LLM input: {llm_input}")
+    # Send to LLM. PROMPT is static so it (plus the board layer) forms a reusable cached prefix.
     response = openai.responses.create(
         model="gpt-4.1",
-        instructions=formatted_prompt,
-        input=f"Card Info: {card}"
+        instructions=PROMPT,
+        input=llm_input
     )
     content = response.output_text
+    usage = get_usage_stats(response)
     print(f"Response: {content}")
+    print(f"Usage: {usage}")
     # Return parsed JSON as Python dict
-    return json.loads(content)
+    return json.loads(content), usage
 
 def prune_summary(summary, card):
     """ Prune the summary to only include relevant columns for the card's type, with durations converted to hours. """
@@ -65,17 +129,25 @@ def prune_summary(summary, card):
 
 def get_historical_card_data(user_id, board_id, card):
     """ Get historical card data from the database, prune summary, and normalize card durations to hours. """
-    # Get summary
+    shared_enabled = is_shared_retrieval_enabled(user_id, board_id)
+
+    # Get summary, falling back to the merged summary for cold-start boards
     summary = get_historical_card_summary(user_id, board_id) or {}
+    shared_summary = None
+    if shared_enabled and summary.get("totalCardsByType", {}).get(card.get("type"), 0) < MIN_LOCAL_SUMMARY_CARDS:
+        shared_summary = get_shared_historical_card_summary(user_id)
+        summary = shared_summary or summary
     print(f"Summary: {summary}")
     
     # Prune summary and convert durations to hours
     summary = prune_summary(summary, card)
+    if shared_summary:
+        summary["includesOtherBoards"] = True
     print(f"Summary after pruning: {summary}")
     
     # Call RAG function, depending on number of results also get random similar cards (same type)
     query_text = f"{card.get('title', '')}\n\n{card.get('description', '')}"
-    similar_cards = fetch_similar_historical_cards(user_id, board_id, query_text)
+    similar_cards = fetch_similar_historical_cards(user_id, board_id, query_text, include_shared=shared_enabled)
     print(f"Similar cards: {similar_cards}")
     if len(similar_cards) < 10:
         # Randomly pull # of cards to get to 10 from the same bug type
@@ -96,11 +168,16 @@ def estimate_card(user_id, board_id, card, codebase_context, columns):
     historical_card_data, historical_card_summary = get_historical_card_data(user_id, board_id, card)
     
     # Call the LLM and return its parsed response
-    result = call_llm(
+    result, usage = call_llm(
         card,
         codebase_context,
         historical_card_data,
         historical_card_summary,
         columns
     )
+    # Usage tracking must never cost the user an already computed estimate
+    try:
+        record_llm_usage(user_id, board_id, usage)
+    except Exception as e:
+        print(f"Error recording LLM usage for board {board_id}: {e}")
     return result
@@ -1,13 +1,17 @@
+# PROMPT is sent verbatim (never formatted) so it stays a byte-identical prefix
+# across requests and can be served from the provider's prompt cache.
 PROMPT = """
 You are an AI assistant that estimates completion times for cards on a Kanban board web application.
 
 All time values (in `codebase_coding_estimate`, `codebase_qa_estimate`, `historical_card_data`, and `historical_card_summary`) are in **days**, represented as numeric values.
 
 Inputs:
-- codebase_context: {codebase_context}
-- historical_card_data: {historical_card_data}
-- historical_card_summary: {historical_card_summary}
-- board_columns: {board_columns}  A JSON array of column objects, each with an `id`, `title`, and optional `description`. This specifies which columns to estimate for.
+The inputs follow these instructions as labelled sections, ordered from most to least stable:
+- board_columns: A JSON array of column objects, each with an `id`, `title`, and optional `description`. This specifies which columns to estimate for.
+- historical_card_summary: Aggregate time statistics for cards of this type. These come from this board unless the summary contains `includesOtherBoards: true`, in which case it is merged across the user's other boards because this board has little history.
+- historical_card_data: Similar historical cards. Cards with `fromOtherBoard: true` come from the user's other boards, whose workflows and columns may differ; weigh them less than cards from this board.
+- codebase_context: Codebase analysis for the card (may be empty).
+- Card Info: The card to estimate.
 
 Task:
 Estimate the time required for **each of the provided `board_columns`**. Use the inputs as follows:
@@ -23,24 +27,24 @@ Assume the card will be completed by a single developer working at a normal pace
 Output:
 Return only a JSON object in the following format. The `columns` field in the output MUST be a dictionary where keys are the `id`s from the input `board_columns`. Each value should be an object containing the `estimate` (numeric, in days) and `justification` (string) for that specific column.
 
-{{
+{
   "total": 6.5,  // Sum of all column estimates
   "justification": "Overall reasoning for the total estimate and general approach.",
-  "columns": {{
-    "column_id_1": {{
+  "columns": {
+    "column_id_1": {
       "estimate": 3.0,
       "justification": "Detailed justification for why column_id_1 will take 3.0 days, considering its description if provided."
-    }},
-    "column_id_2": {{
+    },
+    "column_id_2": {
       "estimate": 2.0,
       "justification": "Justification for column_id_2."
-    }},
-    "column_id_n": {{
+    },
+    "column_id_n": {
       "estimate": 1.5,
       "justification": "Justification for column_id_n, taking into account its specific workflow or description."
-    }}
-  }}
-}}
+    }
+  }
+}
 """
 
 # REMINDER: Future enhancement - support additional custom columns in the output; extend the prompt accordingly.
@@ -1 +1 @@
-from .main import generate_embedding, update_historical_card_summary, update_historical_card_summary_on_delete, get_historical_card_summary, fetch_similar_historical_cards, get_random_historical_card_by_type
\ No newline at end of file
+from .main import generate_embedding, update_historical_card_summary, update_historical_card_summary_on_delete, get_historical_card_summary, fetch_similar_historical_cards, get_random_historical_card_by_type, is_shared_retrieval_enabled, get_shared_historical_card_summary, add_to_shared_historical_cards, remove_from_shared_historical_cards, sync_shared_historical_cards, process_shared_sync_jobs
\ No newline at end of file
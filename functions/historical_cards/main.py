@@ -7,6 +7,13 @@ import random
 
 load_dotenv()
 
+# Multiplier applied to similarity of cards from other boards in the shared tier (board-local cards use 1.0)
+SHARED_LOCALITY_WEIGHT = 0.8
+# Historical cards processed per shared sync job per run (one transaction each)
+SYNC_CHUNK_SIZE = 100
+# Shared sync jobs advanced per scheduled run
+MAX_SYNC_JOBS_PER_RUN = 10
+
 def generate_embedding(data):
     """ Generate an embedding for a given text. """
     parts = []
@@ -65,10 +72,37 @@ def get_random_historical_card_by_type(user_id: str, board_id: str, card_type: s
         result.append(data)
     return result
 
-def fetch_similar_historical_cards(user_id: str, board_id: str, query_text: str) -> list:
+def find_nearest_cards(coll_ref, query_vec, limit: int = 15) -> list:
+    """
+    Run a single KNN query on a historical card collection, returning dicts with
+    their cosine distance under "vectorDistance".
+    """
+    vector_query = coll_ref.find_nearest(
+        vector_field="embedding",
+        query_vector=Vector(query_vec),
+        distance_measure=DistanceMeasure.COSINE,
+        limit=limit,
+        distance_result_field="vectorDistance"
+    )
+
+    # Collect results
+    results = []
+    for doc in vector_query.stream():
+        item = doc.to_dict() or {}
+        item["id"] = doc.id
+        # Convert per-column durations from ms to hours
+        for entry in item.get("aggregatedTimeInColumns", []):
+            entry["totalDurationHours"] = entry.pop("totalDurationMs", 0) / 3600000.0
+        results.append(item)
+    return results
+
+def fetch_similar_historical_cards(user_id: str, board_id: str, query_text: str, include_shared: bool = False) -> list:
     """
     Embed a query text and return up to `limit` similar historicalCards.
+    With include_shared, also query the user's shared index (one extra query, never per-board)
+    and blend both result sets, scaling shared similarity by SHARED_LOCALITY_WEIGHT.
     """
+    limit = 15
     # Generate embedding for the query text
     response = openai.embeddings.create(
         model="text-embedding-3-small",
@@ -78,30 +112,295 @@ def fetch_similar_historical_cards(user_id: str, board_id: str, query_text: str)
 
     # Firestore client and collection reference
     db = firestore.Client()
+    user_ref = db.collection("users").document(user_id)
     coll_ref = (
+        user_ref.collection("boards").document(board_id)
+                .collection("historicalCards")
+    )
+    local_results = find_nearest_cards(coll_ref, query_vec, limit)
+    if not include_shared:
+        for item in local_results:
+            item.pop("vectorDistance", None)
+        return local_results
+
+    # Shared cards from this board are already covered by the local query
+    shared_results = [
+        item for item in find_nearest_cards(user_ref.collection("sharedHistoricalCards"), query_vec, limit)
+        if item.get("boardId") != board_id
+    ]
+    # Label cross-board neighbours explicitly so the LLM can weigh them down
+    for item in shared_results:
+        item.pop("boardId", None)
+        item["fromOtherBoard"] = True
+    scored = [(1 - item.pop("vectorDistance", 1), item) for item in local_results]
+    scored += [((1 - item.pop("vectorDistance", 1)) * SHARED_LOCALITY_WEIGHT, item) for item in shared_results]
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return [item for _, item in scored[:limit]]
+
+def is_shared_retrieval_enabled(user_id: str, board_id: str) -> bool:
+    """
+    Whether a board has opted in to the user's shared (cross-board) retrieval tier.
+    """
+    db = firestore.Client()
+    board = (
         db.collection("users").document(user_id)
           .collection("boards").document(board_id)
-          .collection("historicalCards")
+          .get()
     )
+    return bool((board.to_dict() or {}).get("sharedRetrievalEnabled"))
 
-    # Perform KNN query
-    vector_query = coll_ref.find_nearest(
-        vector_field="embedding",
-        query_vector=Vector(query_vec),
-        distance_measure=DistanceMeasure.COSINE,
-        limit=15
+def get_shared_historical_card_summary(user_id: str) -> dict:
+    """
+    Get the merged historical card summary across all of a user's opted-in boards.
+    """
+    db = firestore.Client()
+    summary_ref = (
+        db.collection("users").document(user_id)
+          .collection("historicalStats")
+          .document("summary")
+          .get()
     )
+    return summary_ref.to_dict()
 
-    # Collect results
-    results = []
-    for doc in vector_query.stream():
-        item = doc.to_dict() or {}
-        item["id"] = doc.id
-        # Convert per-column durations from ms to hours
-        for entry in item.get("aggregatedTimeInColumns", []):
-            entry["totalDurationHours"] = entry.pop("totalDurationMs", 0) / 3600000.0
-        results.append(item)
-    return results
+def get_shared_refs(doc_ref):
+    """
+    Shared tier references for a board historicalCard doc:
+      /users/{userId}/sharedHistoricalCards/{boardId}_{cardId}
+      /users/{userId}/historicalStats/summary
+    """
+    board_ref = doc_ref.parent.parent
+    user_ref = board_ref.parent.parent
+    shared_ref = user_ref.collection("sharedHistoricalCards").document(f"{board_ref.id}_{doc_ref.id}")
+    summary_ref = user_ref.collection("historicalStats").document("summary")
+    return shared_ref, summary_ref
+
+def share_historical_cards(summary_ref, cards):
+    """
+    Copy embedded historicalCards into the user's shared index and add them to the merged summary,
+    in one transaction. `cards` is a list of (shared_ref, data, vector), with `boardId` set in data.
+    Idempotent, so retried triggers and backfills don't double count.
+    """
+    db = firestore.Client()
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def add_shared_tx(tx):
+        new_cards = [(shared_ref, data, vector) for shared_ref, data, vector in cards
+                     if not shared_ref.get(transaction=tx).exists]
+        if not new_cards:
+            return
+        summary = summary_ref.get(transaction=tx).to_dict() or {}
+        for shared_ref, data, vector in new_cards:
+            apply_card_to_summary(summary, data)
+            tx.set(shared_ref, {**data, "embedding": Vector(list(vector))})
+        tx.set(summary_ref, summary)
+
+    add_shared_tx(transaction)
+
+def unshare_historical_cards(summary_ref, shared_refs):
+    """
+    Remove cards from the user's shared index and subtract them from the merged summary,
+    in one transaction. Cards that are not shared are skipped.
+    """
+    db = firestore.Client()
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def remove_shared_tx(tx):
+        shared_snaps = [snap for snap in (ref.get(transaction=tx) for ref in shared_refs) if snap.exists]
+        if not shared_snaps:
+            return
+        summary = summary_ref.get(transaction=tx).to_dict() or {}
+        for shared_snap in shared_snaps:
+            apply_card_to_summary(summary, shared_snap.to_dict(), delta=-1)
+            tx.delete(shared_snap.reference)
+        # Full set (no merge) so types/columns dropped from the summary are removed
+        tx.set(summary_ref, summary)
+
+    remove_shared_tx(transaction)
+
+def add_to_shared_historical_cards(doc_ref, data, vector):
+    """
+    Share a newly embedded historicalCard, if its board has opted in.
+    """
+    board_ref = doc_ref.parent.parent
+    if not (board_ref.get().to_dict() or {}).get("sharedRetrievalEnabled"):
+        return
+    shared_ref, summary_ref = get_shared_refs(doc_ref)
+    share_historical_cards(summary_ref, [(shared_ref, {**data, "boardId": board_ref.id}, vector)])
+
+def remove_from_shared_historical_cards(doc_ref):
+    """
+    Unshare a deleted historicalCard. No-op if the card was never shared.
+    """
+    shared_ref, summary_ref = get_shared_refs(doc_ref)
+    unshare_historical_cards(summary_ref, [shared_ref])
+
+def sync_shared_historical_cards(board_ref, before, after):
+    """
+    Keep the shared tier in step with a board's `sharedRetrievalEnabled` flag (a deleted board counts as off)
+    by (re)starting its sync job under:
+      /users/{userId}/sharedSyncJobs/{boardId}
+
+    The job is run in chunks by process_shared_sync_jobs:
+      - "add":    backfill the board's embedded historicalCards
+      - "remove": remove every {boardId}_* shared card and subtract it from the merged summary
+    Cards archived but not yet embedded are shared by the historicalCard trigger once embedded.
+    """
+    was_enabled = bool((before or {}).get("sharedRetrievalEnabled"))
+    is_enabled = bool((after or {}).get("sharedRetrievalEnabled"))
+    if was_enabled == is_enabled:
+        return
+
+    action = "add" if is_enabled else "remove"
+    print(f"Starting shared retrieval sync ({action}) for board {board_ref.id}")
+    job_ref = board_ref.parent.parent.collection("sharedSyncJobs").document(board_ref.id)
+    # Overwrites any in-flight job, e.g. opting out in the middle of a backfill
+    job_ref.set({
+        "boardId": board_ref.id,
+        "action": action,
+        "cursor": None,
+        "processed": 0,
+        "complete": False,
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    })
+
+def run_shared_sync_chunk(db, job_doc):
+    """
+    Process up to SYNC_CHUNK_SIZE cards of one sync job in a single transaction and record progress.
+    The progress write is conditional on the job being unchanged, so a job restarted meanwhile is not clobbered.
+    """
+    job = job_doc.to_dict() or {}
+    user_ref = job_doc.reference.parent.parent
+    board_id = job_doc.id
+    summary_ref = user_ref.collection("historicalStats").document("summary")
+    cursor = job.get("cursor")
+
+    if job.get("action") == "add":
+        cards_ref = user_ref.collection("boards").document(board_id).collection("historicalCards")
+        query = cards_ref.order_by("__name__")
+        if cursor:
+            query = query.where("__name__", ">", cards_ref.document(cursor))
+        docs = list(query.limit(SYNC_CHUNK_SIZE).stream())
+        cards = []
+        for card_doc in docs:
+            data = card_doc.to_dict() or {}
+            vector = data.pop("embedding", None)
+            data["boardId"] = board_id
+            if vector is not None:
+                cards.append((get_shared_refs(card_doc.reference)[0], data, vector))
+        if cards:
+            share_historical_cards(summary_ref, cards)
+        if docs:
+            cursor = docs[-1].id
+    else:
+        # Removed docs drop out of the query, so no cursor is needed
+        docs = list(
+            user_ref.collection("sharedHistoricalCards")
+                    .where("boardId", "==", board_id)
+                    .limit(SYNC_CHUNK_SIZE)
+                    .stream()
+        )
+        if docs:
+            unshare_historical_cards(summary_ref, [doc.reference for doc in docs])
+
+    job_doc.reference.update({
+        "cursor": cursor,
+        "processed": firestore.Increment(len(docs)),
+        "complete": len(docs) < SYNC_CHUNK_SIZE,
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }, option=db.write_option(last_update_time=job_doc.update_time))
+
+def process_shared_sync_jobs():
+    """
+    Advance every incomplete shared retrieval sync job by one chunk.
+    Progress (`cursor`, `processed`, `complete`) is stored on the job doc, so large boards finish over several runs.
+    """
+    db = firestore.Client()
+    job_docs = list(
+        db.collection_group("sharedSyncJobs")
+          .where("complete", "==", False)
+          .limit(MAX_SYNC_JOBS_PER_RUN)
+          .stream()
+    )
+    print(f"Incomplete shared sync jobs: {len(job_docs)}")
+    for job_doc in job_docs:
+        try:
+            run_shared_sync_chunk(db, job_doc)
+        except Exception as e:
+            # The job stays incomplete and is retried on the next run
+            print(f"Error running shared sync job for board {job_doc.id}: {e}")
+
+def apply_card_to_summary(summary, data, delta=1):
+    """
+    Add (delta=1) or remove (delta=-1) a single historical card's stats to/from a summary dict in place.
+    Types and columns whose card count drops to zero are removed.
+    """
+    # Precompute this card's total time and extract its per-column entries
+    total_duration_ms = sum(e.get("totalDurationMs", 0)
+                         for e in data.get("aggregatedTimeInColumns", []))
+    time_entries = data.get("aggregatedTimeInColumns", [])  # list of {columnId, totalDurationMs}
+    card_type = data.get("type", "unknown")               # e.g. 'bug', 'feature'
+
+    # 1) Global card count
+    summary["totalCards"] = summary.get("totalCards", 0) + delta
+
+    # 2) Per-type aggregates
+    total_cards_by_type_map    = summary.setdefault("totalCardsByType", {})    # {type: count}
+    total_duration_by_type_map = summary.setdefault("totalDurationByType", {})   # {type: ms}
+    total_cards_by_type_map[card_type]    = total_cards_by_type_map.get(card_type, 0)    + delta
+    total_duration_by_type_map[card_type] = total_duration_by_type_map.get(card_type, 0) + delta * total_duration_ms
+
+    # 3) Per-type-per-column breakdown
+    duration_per_column_map = summary.setdefault("totalDurationByTypePerColumn", {})   # {type: {columnId: ms}}
+    count_per_column_map    = summary.setdefault("totalCardsByTypePerColumn", {})      # {type: {columnId: count}}
+    column_duration_map = duration_per_column_map.setdefault(card_type, {})  # nested for this type
+    column_count_map    = count_per_column_map.setdefault(card_type, {})     # nested for this type
+    for entry in time_entries:
+        col_id = entry.get("columnId")
+        dur_ms = entry.get("totalDurationMs", 0)
+        # accumulate durations and counts per column
+        column_duration_map[col_id] = column_duration_map.get(col_id, 0) + delta * dur_ms
+        column_count_map[col_id]    = column_count_map.get(col_id, 0)    + delta
+        if column_count_map[col_id] <= 0:
+            column_duration_map.pop(col_id, None)
+            column_count_map.pop(col_id, None)
+
+    # 4) Averages per type
+    average_by_type_map = summary.setdefault("averageDurationByType", {})            # {type: avgMs}
+    average_per_column_map = summary.setdefault("averageDurationByTypePerColumn", {}) # {type: {columnId: avgMs}}
+    if total_cards_by_type_map[card_type] <= 0:
+        # Last card of this type removed
+        for type_map in (total_cards_by_type_map, total_duration_by_type_map, duration_per_column_map,
+                         count_per_column_map, average_by_type_map, average_per_column_map):
+            type_map.pop(card_type, None)
+    else:
+        average_by_type_map[card_type] = (
+            total_duration_by_type_map[card_type] 
+            / total_cards_by_type_map[card_type]
+        )
+
+        # 5) Averages per column per type
+        avg_map = { col: column_duration_map[col] / column_count_map[col]
+                    for col in column_duration_map }
+        average_per_column_map[card_type] = avg_map
+
+    # 6) Averages across all types per column (global)
+    # Sum durations and counts across all types for each column
+    overall_duration_by_column = {}
+    overall_count_by_column = {}
+    for type_map in summary.get("totalDurationByTypePerColumn", {}).values():
+        for col, dur in type_map.items():
+            overall_duration_by_column[col] = overall_duration_by_column.get(col, 0) + dur
+    for count_map in summary.get("totalCardsByTypePerColumn", {}).values():
+        for col, cnt in count_map.items():
+            overall_count_by_column[col] = overall_count_by_column.get(col, 0) + cnt
+    # Compute and set overall average per column
+    summary["averageDurationPerColumn"] = {
+        col: (overall_duration_by_column[col] / overall_count_by_column.get(col, 1))
+        for col in overall_duration_by_column
+    }
+    return summary
 
 def update_historical_card_summary(doc_ref, data):
     """
@@ -137,71 +436,18 @@ def update_historical_card_summary(doc_ref, data):
                .document("summary")
     )
 
-    # Precompute this card's total time and extract its per-column entries
-    total_duration_ms = sum(e.get("totalDurationMs", 0)
-                         for e in data.get("aggregatedTimeInColumns", []))
-    time_entries = data.get("aggregatedTimeInColumns", [])  # list of {columnId, totalDurationMs}
-    card_type = data.get("type", "unknown")               # e.g. 'bug', 'feature'
-
     transaction = db.transaction()
 
     @firestore.transactional
     def update_summary_tx(tx):
-        # 1) Load current summary snapshot (or start fresh)
+        # Load current summary snapshot (or start fresh)
         snap = summary_ref.get(transaction=tx)
         summary = snap.to_dict() or {}
 
-        # 2) Global card count
-        summary["totalCards"] = summary.get("totalCards", 0) + 1
-
-        # 3) Per-type aggregates
-        total_cards_by_type_map    = summary.setdefault("totalCardsByType", {})    # {type: count}
-        total_duration_by_type_map = summary.setdefault("totalDurationByType", {})   # {type: ms}
-        total_cards_by_type_map[card_type]    = total_cards_by_type_map.get(card_type, 0)    + 1
-        total_duration_by_type_map[card_type] = total_duration_by_type_map.get(card_type, 0) + total_duration_ms
-
-        # 4) Per-type-per-column breakdown
-        duration_per_column_map = summary.setdefault("totalDurationByTypePerColumn", {})   # {type: {columnId: ms}}
-        count_per_column_map    = summary.setdefault("totalCardsByTypePerColumn", {})      # {type: {columnId: count}}
-        column_duration_map = duration_per_column_map.setdefault(card_type, {})  # nested for this type
-        column_count_map    = count_per_column_map.setdefault(card_type, {})     # nested for this type
-        for entry in time_entries:
-            col_id = entry.get("columnId")
-            dur_ms = entry.get("totalDurationMs", 0)
-            # accumulate durations and counts per column
-            column_duration_map[col_id] = column_duration_map.get(col_id, 0) + dur_ms
-            column_count_map[col_id]    = column_count_map.get(col_id, 0)    + 1
-
-        # 5) Averages per type
-        average_by_type_map = summary.setdefault("averageDurationByType", {})            # {type: avgMs}
-        average_by_type_map[card_type] = (
-            total_duration_by_type_map[card_type] 
-            / total_cards_by_type_map[card_type]
-        )
-
-        # 6) Averages per column per type
-        average_per_column_map = summary.setdefault("averageDurationByTypePerColumn", {}) # {type: {columnId: avgMs}}
-        avg_map = { col: column_duration_map[col] / column_count_map[col]
-                    for col in column_duration_map }
-        average_per_column_map[card_type] = avg_map
+        # Add this card's stats and averages (see apply_card_to_summary)
+        apply_card_to_summary(summary, data)
 
-        # 7) Averages across all types per column (global)
-        # Sum durations and counts across all types for each column
-        overall_duration_by_column = {}
-        overall_count_by_column = {}
-        for type_map in summary.get("totalDurationByTypePerColumn", {}).values():
-            for col, dur in type_map.items():
-                overall_duration_by_column[col] = overall_duration_by_column.get(col, 0) + dur
-        for count_map in summary.get("totalCardsByTypePerColumn", {}).values():
-            for col, cnt in count_map.items():
-                overall_count_by_column[col] = overall_count_by_column.get(col, 0) + cnt
-        # Compute and set overall average per column
-        summary["averageDurationPerColumn"] = {
-            col: (overall_duration_by_column[col] / overall_count_by_column.get(col, 1))
-            for col in overall_duration_by_column
-        }
-        
-        # 8) Write merged summary back to Firestore
+        # Write merged summary back to Firestore
         tx.set(summary_ref, summary, merge=True)
 
     # Execute transactional update
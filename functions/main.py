@@ -6,8 +6,9 @@ from firebase_functions import https_fn, options
 from firebase_admin import initialize_app
 from codebase_query import codebase_query
 from card_time_estimate import estimate_card
-from historical_cards import generate_embedding, update_historical_card_summary, update_historical_card_summary_on_delete
-from firebase_functions import firestore_fn
+from historical_cards import generate_embedding, update_historical_card_summary, update_historical_card_summary_on_delete, add_to_shared_historical_cards, remove_from_shared_historical_cards, sync_shared_historical_cards, process_shared_sync_jobs
+from background_estimates import enqueue_changed_cards, process_pending_estimates
+from firebase_functions import firestore_fn, scheduler_fn
 import json
 
 initialize_app()
@@ -53,6 +54,7 @@ def new_historical_card(event: firestore_fn.Event[firestore_fn.DocumentSnapshot]
     """Fire when a historicalCard is created: 
         - Compute and store its vector embedding
         - Update historical card summary
+        - Add it to the user's shared retrieval tier (if the board opted in)
     """
     snapshot = event.data
     if not snapshot:
@@ -68,12 +70,16 @@ def new_historical_card(event: firestore_fn.Event[firestore_fn.DocumentSnapshot]
     # Update historical cards summary
     update_historical_card_summary(snapshot.reference, data)
 
+    # Update shared cross-board index and merged summary
+    add_to_shared_historical_cards(snapshot.reference, data, vector)
+
 @firestore_fn.on_document_deleted(
     document="users/{userId}/boards/{boardId}/historicalCards/{cardId}"
 )
 def delete_historical_card(event: firestore_fn.Event[firestore_fn.DocumentSnapshot]):
     """Fire when a historicalCard is deleted:
         - Update historical card summary by removing its stats
+        - Remove it from the user's shared retrieval tier
     """
     print("inside delete_historical_card")
     snapshot = event.data
@@ -82,3 +88,42 @@ def delete_historical_card(event: firestore_fn.Event[firestore_fn.DocumentSnapsh
     data = snapshot.to_dict()
 
     update_historical_card_summary_on_delete(snapshot.reference, data)
+
+    remove_from_shared_historical_cards(snapshot.reference)
+
+
+@firestore_fn.on_document_written(
+    document="users/{userId}/boards/{boardId}"
+)
+def board_written(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]):
+    """Fire when a board is written:
+        - Queue new cards, or cards whose title, description, type or estimation columns changed,
+          for a background estimate (only when the board has backgroundEstimatesEnabled)
+        - Start a shared retrieval backfill/removal job when sharedRetrievalEnabled flips or the board is deleted
+    """
+    if not event.data:
+        return
+    # On deletion `after` is None (and on creation `before` is None)
+    before_snap, after_snap = event.data.before, event.data.after
+    board_ref = (after_snap if after_snap is not None else before_snap).reference
+    before = before_snap.to_dict() if before_snap and before_snap.exists else None
+    after = after_snap.to_dict() if after_snap and after_snap.exists else None
+
+    # Each feature is isolated so a failure in one never blocks the other
+    try:
+        sync_shared_historical_cards(board_ref, before, after)
+    except Exception as e:
+        print(f"Error syncing shared retrieval for board {board_ref.id}: {e}")
+
+    if after:
+        enqueue_changed_cards(board_ref, before, after)
+
+@scheduler_fn.on_schedule(schedule="every 1 minutes", timeout_sec=540)
+def run_background_estimates(event: scheduler_fn.ScheduledEvent) -> None:
+    """Estimate queued cards once their edits have settled and write the result to the card's timeEstimate."""
+    process_pending_estimates()
+
+@scheduler_fn.on_schedule(schedule="every 1 minutes", timeout_sec=540)
+def run_shared_retrieval_sync(event: scheduler_fn.ScheduledEvent) -> None:
+    """Advance shared retrieval backfill/removal jobs by one chunk each."""
+    process_shared_sync_jobs()
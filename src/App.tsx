@@ -3,7 +3,7 @@ import { DndContext, PointerSensor, useSensor, useSensors, DragOverlay } from '@
 import './App.css';
 import Board from './components/Board/Board';
 import StatsPanel from './components/StatsPanel';
-import ProjectSettingsPanel from './components/ProjectSettingsPanel';
+import ProjectSettingsPanel, { ProjectEstimateSettings, DEFAULT_BACKGROUND_ESTIMATE_BUDGET } from './components/ProjectSettingsPanel';
 import Auth from './components/Auth';
 import { useBoard } from './hooks/useBoard';
 import { useBoards } from './hooks/useBoards';
@@ -46,7 +46,7 @@ function App() {
   // Load the current board
   const activeBoard = boards.find(b => b.id === currentBoardId);
   const isSharedBoard = activeBoard?.isShared ?? false; // TODO: default value being false is a type hack, figure out later
-  const { board, loading, updateColumns, updateUserInfoToBoard, updateBoardTitle, deleteColumn, updateColumnTitle, addColumn, addCard, updateCard, deleteCard, archiveCard, restoreCard, moveCard } = useBoard(user, currentBoardId, isSharedBoard);
+  const { board, loading, updateColumns, updateUserInfoToBoard, updateBoardTitle, updateBackgroundEstimateSettings, updateSharedRetrieval, deleteColumn, updateColumnTitle, addColumn, addCard, updateCard, deleteCard, archiveCard, restoreCard, moveCard } = useBoard(user, currentBoardId, isSharedBoard);
 
   // Only update board user info once when board loads and user data differs
   useEffect(() => {
@@ -115,8 +115,17 @@ function App() {
   }, [isChatOpen, openAIApiKey]);
 
   // Handler to save project settings
-  const handleSaveProjectSettings = (updatedColumns: Column[]) => {
+  const handleSaveProjectSettings = (updatedColumns: Column[], settings: ProjectEstimateSettings) => {
     updateColumns(updatedColumns);
+    if (board && (
+      settings.backgroundEstimatesEnabled !== !!board.backgroundEstimatesEnabled ||
+      settings.backgroundEstimateBudget !== (board.backgroundEstimateBudget ?? DEFAULT_BACKGROUND_ESTIMATE_BUDGET)
+    )) {
+      updateBackgroundEstimateSettings(settings.backgroundEstimatesEnabled, settings.backgroundEstimateBudget);
+    }
+    if (board && settings.sharedRetrievalEnabled !== !!board.sharedRetrievalEnabled) {
+      updateSharedRetrieval(settings.sharedRetrievalEnabled);
+    }
     setShowSettings(false);
   };
   // If checking auth
@@ -2,14 +2,28 @@ import React, { useState, useEffect } from 'react';
 import { Board, Column } from '../types';
 import './ProjectSettingsPanel.css';
 
+// Matches DEFAULT_BUDGET in functions/background_estimates
+export const DEFAULT_BACKGROUND_ESTIMATE_BUDGET = 100;
+
+export interface ProjectEstimateSettings {
+    backgroundEstimatesEnabled: boolean;
+    backgroundEstimateBudget: number;
+    sharedRetrievalEnabled: boolean;
+}
+
 interface ProjectSettingsPanelProps {
     board: Board;
-    onSave: (columns: Column[]) => void;
+    onSave: (columns: Column[], settings: ProjectEstimateSettings) => void;
     onClose: () => void;
 }
 
 const ProjectSettingsPanel: React.FC<ProjectSettingsPanelProps> = ({ board, onSave, onClose }) => {
     const [columns, setColumns] = useState<Column[]>(board.columns);
+    const [settings, setSettings] = useState<ProjectEstimateSettings>({
+        backgroundEstimatesEnabled: !!board.backgroundEstimatesEnabled,
+        backgroundEstimateBudget: board.backgroundEstimateBudget ?? DEFAULT_BACKGROUND_ESTIMATE_BUDGET,
+        sharedRetrievalEnabled: !!board.sharedRetrievalEnabled,
+    });
 
     const toggleEnabled = (id: string) => {
         setColumns(prevCols => {
@@ -34,12 +48,50 @@ const ProjectSettingsPanel: React.FC<ProjectSettingsPanelProps> = ({ board, onSa
     };
 
     const handleSave = () => {
-        onSave(columns);
+        onSave(columns, settings);
     };
 
     return (
         <div className="project-settings-panel">
             <h2>Project Settings</h2>
+            <div className="project-settings-item">
+                <div className="column-title-setting">
+                    <h3>Background estimates</h3>
+                    <label className="toggle-switch-label">
+                        <span className="toggle-label-text">Estimate new and edited cards automatically:</span>
+                        <input
+                            type="checkbox"
+                            className="toggle-switch"
+                            checked={settings.backgroundEstimatesEnabled}
+                            onChange={() => setSettings(prev => ({ ...prev, backgroundEstimatesEnabled: !prev.backgroundEstimatesEnabled }))}
+                        />
+                    </label>
+                </div>
+                <label className="toggle-switch-label">
+                    <span className="toggle-label-text">Max background estimates for this board:</span>
+                    <input
+                        type="number"
+                        min={0}
+                        className="estimate-budget-input"
+                        value={settings.backgroundEstimateBudget}
+                        onChange={e => setSettings(prev => ({ ...prev, backgroundEstimateBudget: Math.max(0, Number(e.target.value) || 0) }))}
+                    />
+                </label>
+            </div>
+            <div className="project-settings-item">
+                <div className="column-title-setting">
+                    <h3>Shared history</h3>
+                    <label className="toggle-switch-label">
+                        <span className="toggle-label-text">Use and contribute to history from your other boards:</span>
+                        <input
+                            type="checkbox"
+                            className="toggle-switch"
+                            checked={settings.sharedRetrievalEnabled}
+                            onChange={() => setSettings(prev => ({ ...prev, sharedRetrievalEnabled: !prev.sharedRetrievalEnabled }))}
+                        />
+                    </label>
+                </div>
+            </div>
             <div className="project-settings-list">
                 {columns.map(col => (
                     <div key={col.id} className="project-settings-item">
@@ -108,6 +108,42 @@ export const useBoard = (
     }
   }, [board]);
 
+  const updateBackgroundEstimateSettings = useCallback(async (enabled: boolean, budget: number) => {
+    if (!boardDocRef.current) {
+      console.error("Board document reference is not available. Cannot update background estimate settings.");
+      throw new Error("Board document reference is required to update background estimate settings.");
+    }
+
+    try {
+      setBoard(prev => {
+        if (!prev) return null;
+        return { ...prev, backgroundEstimatesEnabled: enabled, backgroundEstimateBudget: budget };
+      });
+      await BoardService.updateBackgroundEstimateSettings(boardDocRef.current, enabled, budget);
+    } catch (err) {
+      console.error("Failed to update background estimate settings:", err);
+      throw err;
+    }
+  }, [board]);
+
+  const updateSharedRetrieval = useCallback(async (enabled: boolean) => {
+    if (!boardDocRef.current) {
+      console.error("Board document reference is not available. Cannot update shared retrieval.");
+      throw new Error("Board document reference is required to update shared retrieval.");
+    }
+
+    try {
+      setBoard(prev => {
+        if (!prev) return null;
+        return { ...prev, sharedRetrievalEnabled: enabled };
+      });
+      await BoardService.updateSharedRetrieval(boardDocRef.current, enabled);
+    } catch (err) {
+      console.error("Failed to update shared retrieval:", err);
+      throw err;
+    }
+  }, [board]);
+
   const deleteColumn = useCallback(async (columnId: string) => {
     if (!boardDocRef.current || !board || !columnId) {
       console.error("Board document reference is not available. Cannot delete column.");
@@ -423,6 +459,8 @@ export const useBoard = (
     updateColumns,
     updateUserInfoToBoard,
     updateBoardTitle,
+    updateBackgroundEstimateSettings,
+    updateSharedRetrieval,
     deleteColumn,
     updateColumnTitle,
     addColumn,
@@ -452,6 +490,9 @@ const processBoardData = (data: FirebaseBoard): Board => {
     columns: data.columns,
     archivedCards: data.archivedCards,
     users: data.users,
+    backgroundEstimatesEnabled: data.backgroundEstimatesEnabled,
+    backgroundEstimateBudget: data.backgroundEstimateBudget,
+    sharedRetrievalEnabled: data.sharedRetrievalEnabled,
   };
 
   Object.entries(board.cards).forEach(([cardId, cardData]) => {
@@ -64,6 +64,23 @@ export const BoardService = {
         await updateDoc(boardDocRef, { title: newTitle });
     },
 
+    // Settings for background time estimates (see functions/background_estimates)
+    async updateBackgroundEstimateSettings(boardDocRef: DocumentReference, enabled: boolean, budget: number): Promise<void> {
+        await updateDoc(boardDocRef, {
+            backgroundEstimatesEnabled: enabled,
+            backgroundEstimateBudget: budget,
+            updatedAt: serverTimestamp(),
+        });
+    },
+
+    // Opt the board in/out of the owner's shared retrieval tier (see functions/historical_cards)
+    async updateSharedRetrieval(boardDocRef: DocumentReference, enabled: boolean): Promise<void> {
+        await updateDoc(boardDocRef, {
+            sharedRetrievalEnabled: enabled,
+            updatedAt: serverTimestamp(),
+        });
+    },
+
     /**
      * Move a card: receives all computed values and performs the DB update only.
      * @param boardDocRef Firestore document reference
@@ -147,6 +147,13 @@ export interface Board {
   };
   columns: Column[];
   archivedCards: Card[];
+
+  // 🆕 Opt-in background time estimates for new/edited cards (see functions/background_estimates)
+  backgroundEstimatesEnabled?: boolean;
+  backgroundEstimateBudget?: number; // Max background estimates this board may run
+
+  // 🆕 Opt-in to the owner's shared cross-board retrieval tier (see functions/historical_cards)
+  sharedRetrievalEnabled?: boolean;
 }
 
 // TODO: Theoeritecally I need to update all the subtypes to use timestamp instead of Date. TBD
@@ -164,6 +171,13 @@ export interface FirebaseBoard {
   };
   columns: Column[];
   archivedCards: Card[];
+
+  // 🆕 Opt-in background time estimates for new/edited cards (see functions/background_estimates)
+  backgroundEstimatesEnabled?: boolean;
+  backgroundEstimateBudget?: number; // Max background estimates this board may run
+
+  // 🆕 Opt-in to the owner's shared cross-board retrieval tier (see functions/historical_cards)
+  sharedRetrievalEnabled?: boolean;
 }
 
 // 🆕 Historical Card Type for long-term storage and analysis